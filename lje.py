@@ -6,18 +6,21 @@ import sys; sys.dont_write_bytecode = True
 import collections
 import contextlib
 import datetime
+import hashlib
 import itertools
+import json
 import logging
 import operator
 import os
 import pathlib
-import shutil
+import re
 import sqlite3
 import tempfile
 
 import click
 import CommonMark
 import jinja2
+import markupsafe
 import requests
 
 __version__ = "0.1a"
@@ -86,6 +89,7 @@ class CursorWrapper:
         self.upsert_option("author.name", None)
         self.upsert_option("blog.favicon.ico", None)
         self.upsert_option("blog.favicon.png", None)
+        self.upsert_option("blog.inline_css_limit", 0)
         self.upsert_option("blog.page_size", 10)
         self.upsert_option("blog.theme", "eigenein")
         self.upsert_option("blog.title", None)
@@ -206,6 +210,12 @@ def paginate(items, page_size):
     return [items[i:(i + page_size)] for i in range(0, len(items), page_size)]
 
 
+def fingerprint(name, data):
+    "Gets content-hashed file name. Example: theme.css -> theme.0123abcd.css."
+    stem, suffix = os.path.splitext(name)
+    return "{0}.{1}{2}".format(stem, hashlib.md5(data).hexdigest()[:8], suffix)
+
+
 def format_option_value(value):
     if not isinstance(value, bytes):
         return repr(value)
@@ -265,6 +275,9 @@ class CommonArguments:
 # Build command.
 # ------------------------------------------------------------------------------
 
+Asset = collections.namedtuple("Asset", ["name", "data"])
+
+
 @click.command(short_help="Build blog.")
 @CommonArguments.existing_database
 @click.argument("path", metavar="<path>")
@@ -285,6 +298,14 @@ class BlogBuilder:
     common_mark_parser = CommonMark.DocParser()
     common_mark_renderer = CommonMark.HTMLRenderer()
 
+    # Asset names and where they come from.
+    asset_sources = {
+        "favicon.ico": "`blog.favicon.ico` option",
+        "favicon.png": "`blog.favicon.png` option",
+        "theme.css": "theme file `theme.css`",
+    }
+    manifest_name = "assets.json"
+
     def __init__(self, cursor, path):
         self.cursor = cursor
         self.path = path
@@ -295,11 +316,13 @@ class BlogBuilder:
         self.initialize_index()
         self.page_size = self.cursor.get_option("blog.page_size")
         self.theme_path = pathlib.Path(__file__).parent / "themes" / self.cursor.get_option("blog.theme")
+        self.blog_url = self.cursor.get_option("blog.url") or ""
+        self.inline_css_limit = self.cursor.get_option("blog.inline_css_limit") or 0
+        self.copy_static_files()
         self.make_template_environment()
         self.make_context()
         self.build_index(self.index, self.path)
         self.build_posts()
-        self.copy_static_files()
 
     def initialize_index(self):
         logging.info("Initializing index…")
@@ -344,7 +367,9 @@ class BlogBuilder:
     def make_template_environment(self):
         self.env = jinja2.Environment(loader=jinja2.PackageLoader("lje", str(self.theme_path)))
         self.env.filters.update({
+            "asset": self.asset_url,
             "markdown": self.markdown,
+            "stylesheet": self.stylesheet,
             "joinsegments": lambda segments: "".join(map("/{0}".format, segments)),
             "tags": self.cursor.get_post_tags,
             "timestamp": datetime.datetime.utcfromtimestamp,
@@ -355,6 +380,29 @@ class BlogBuilder:
         ast = self.common_mark_parser.parse(text)
         return self.common_mark_renderer.render(ast)
 
+    def asset_url(self, name):
+        "Gets content-hashed asset URL by its original name."
+        return "{0}/{1}".format(self.blog_url, self.get_asset(name).name)
+
+    def stylesheet(self, name):
+        "Renders stylesheet link or inline style if it is small enough."
+        asset = self.get_asset(name)
+        if len(asset.data) <= self.inline_css_limit:
+            # Escape `</` so that the stylesheet can't close the `style` element.
+            css = asset.data.decode("utf-8").replace("</", "<\\/")
+            return markupsafe.Markup("<style>{0}</style>").format(markupsafe.Markup(css))
+        return markupsafe.Markup('<link rel="stylesheet" href="{0}">').format(self.asset_url(name))
+
+    def get_asset(self, name):
+        "Gets asset by its original name."
+        try:
+            return self.assets[name]
+        except KeyError:
+            source = self.asset_sources.get(name)
+            if source:
+                raise click.ClickException("asset `{0}` is missing, check {1}".format(name, source))
+            raise click.ClickException("unknown asset `{0}`".format(name))
+
     def render(self, path, template_name, **context):
         "Renders template to the specified path."
         if not path.parent.exists():
@@ -365,19 +413,91 @@ class BlogBuilder:
             fp.write(body)
 
     def copy_static_files(self):
-        "Copies static files to build path."
+        "Copies static files to build path under content-hashed names."
         logging.info("Copying static files…")
-        shutil.copy(str(self.theme_path / "theme.css"), str(self.path / "theme.css"))
-        self.dump_option("blog.favicon.ico", self.path / "favicon.ico")
-        self.dump_option("blog.favicon.png", self.path / "favicon.png")
-
-    def dump_option(self, name, path):
-        "Dumps binary option into file."
+        self.assets = {}
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+        manifest_path = self.path / self.manifest_name
+        old_manifest = self.read_manifest(manifest_path)
+        with (self.theme_path / "theme.css").open("rb") as fp:
+            self.write_asset("theme.css", fp.read())
+        favicon_ico = self.dump_option("blog.favicon.ico", "favicon.ico")
+        if favicon_ico:
+            # Clients request `/favicon.ico` without looking at the page.
+            self.write_file(self.path / "favicon.ico", favicon_ico)
+        self.dump_option("blog.favicon.png", "favicon.png")
+        self.write_manifest(manifest_path)
+        self.remove_stale_files(old_manifest, favicon_ico)
+
+    def dump_option(self, name, asset_name):
+        "Dumps binary option into asset file."
         value = self.cursor.get_option(name)
         if value:
-            logging.info("Writing `%s`…", path)
-            with path.open("wb") as fp:
-                fp.write(value)
+            self.write_asset(asset_name, value)
+        return value
+
+    def write_asset(self, name, data):
+        "Writes content-hashed asset file."
+        asset = Asset(fingerprint(name, data), data)
+        self.write_file(self.path / asset.name, data)
+        self.assets[name] = asset
+
+    def write_file(self, path, data):
+        "Writes binary file."
+        logging.info("Writing `%s`…", path)
+        with path.open("wb") as fp:
+            fp.write(data)
+
+    def read_manifest(self, path):
+        "Reads asset manifest of the previous build. Returns None if it's missing or invalid."
+        if not path.exists():
+            return None
+        try:
+            with open(str(path), "rt", encoding="utf-8") as fp:
+                manifest = json.load(fp)
+        except ValueError:
+            logging.warning("Ignoring invalid asset manifest `%s`.", path)
+            return None
+        if not isinstance(manifest, dict) or not all(
+            isinstance(key, str) and isinstance(value, str) for key, value in manifest.items()
+        ):
+            logging.warning("Ignoring invalid asset manifest `%s`.", path)
+            return None
+        return manifest
+
+    def write_manifest(self, path):
+        "Writes asset manifest that maps original names to content-hashed ones."
+        logging.info("Writing `%s`…", path)
+        manifest = {name: asset.name for name, asset in self.assets.items()}
+        with open(str(path), "wt", encoding="utf-8") as fp:
+            json.dump(manifest, fp, indent=2, sort_keys=True)
+
+    def remove_stale_files(self, old_manifest, keep_favicon_ico):
+        """
+        Removes unhashed files of older builds and hashed assets that are used
+        neither by this build nor by the previous one, since cached pages may
+        still refer to the latter.
+        """
+        names = {"theme.css", "favicon.png"}
+        if not keep_favicon_ico:
+            names.add("favicon.ico")
+        if old_manifest is not None:
+            patterns = [
+                re.compile(r"{0}\.[0-9a-f]{{8}}{1}$".format(*map(re.escape, os.path.splitext(name))))
+                for name in self.asset_sources
+            ]
+            names.update(
+                path.name for path in self.path.iterdir()
+                if path.is_file() and any(pattern.match(path.name) for pattern in patterns)
+            )
+            names -= set(old_manifest.values())
+        names -= {asset.name for asset in self.assets.values()}
+        for name in sorted(names):
+            path = self.path / name
+            if path.exists():
+                logging.info("Removing `%s`…", path)
+                path.unlink()
 
 
 class Index: